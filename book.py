@@ -9,23 +9,64 @@ from __future__ import annotations
 __license__ = 'GPL v3'
 __author__ = 'Waldo Luis Ribeiro'
 
+import concurrent.futures
 import csv
+import functools
+import io
 import os
 import random
 import re
 
+import numpy as np
 import zhon.hanzi
 
 from utils import index_of_first
 
+# unicode range for Chinese characters
+FIRST_HANZI = 0x4e00
+LAST_HANZI = 0x9fff
+
+# books are scanned for hanzi in chunks of this many characters
+SCAN_CHUNK_SIZE = 1 << 20
+
+# processed books are cached here between sessions (see main.book_cache)
+CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                          'chinese-book-analyser')
+# increment whenever the book's attributes or the way they are calculated change
+CACHE_VERSION = 7
+
+
+@functools.lru_cache(maxsize=1)
+def sentence_regex() -> re.Pattern:
+    """
+    Returns the compiled regular expression used to split books into sentences.
+    The pattern is only built and compiled the first time it is requested.
+
+    :return: Returns the compiled sentence regular expression
+    :rtype: re.Pattern
+    """
+    start_sentence = zhon.hanzi.characters + r'\w'
+    latin_non_stops = r'\.\-#(),;:%$&*+/<=>@\[\]^_`{|}~\\ '
+    mid_sentence = start_sentence + zhon.hanzi.radicals + zhon.hanzi.non_stops + r'─．○' + latin_non_stops
+    latin_stops = r'!?'
+    chinese_stops = zhon.hanzi.stops + r'…\n'
+    stops = chinese_stops + latin_stops
+    end_sentence = f'[{stops}][」﹂”』’》）］｝〕〗〙〛〉】]*'
+    # every start character is also a mid character, so a single leading match is enough and avoids
+    # the nested repetition that made unterminated runs backtrack quadratically
+    return re.compile(fr'([{start_sentence}][{mid_sentence}]*{end_sentence})')
+
 
 class Hanzi:
+    __slots__ = ('hanzi', 'frequency', 'occurrences', 'distance', 'sentence_count', 'example_sentences')
+
     def __init__(self, hanzi: str, frequency: int = 1) -> None:
         self.hanzi = hanzi
         self.frequency = frequency
-        self.occurrences = []  # list of indices where hanzi occurs
+        self.occurrences = np.empty(0, dtype=np.int32)  # array of indices where hanzi occurs
         self.distance = None
-        self.example_sentences = []
+        self.sentence_count = 0  # number of the book's sentences in which hanzi occurs
+        self.example_sentences = []  # list of indices of a random sample of those sentences
 
     def calculate_average_distance(self) -> None:
         """
@@ -35,50 +76,15 @@ class Hanzi:
         :rtype: None
         """
         if self.frequency > 1:
-            total_distance = 0
-            for i in range(1, len(self.occurrences)):
-                total_distance += self.occurrences[i] - self.occurrences[i - 1]
-            self.distance = round(total_distance / (len(self.occurrences) - 1))
+            # the distances between consecutive occurrences add up to the distance between the first and the last
+            total_distance = int(self.occurrences[-1] - self.occurrences[0])
+            self.distance = round(total_distance / (self.frequency - 1))
         elif self.frequency == 1:
             self.distance = 0
 
-    def find_example_sentences(self, sentences: list[str]) -> None:
-        """
-        Finds example sentences in text.
-
-        :param sentences: List of sentences in which to look for example sentences
-        :type sentences: list
-
-        :raises ValueError: No example sentences found
-
-        :return: None
-        :rtype: None
-        """
-        for sentence in sentences:
-            if self.hanzi in sentence:
-                self.example_sentences.append(sentence)
-        if len(self.example_sentences) == 0:
-            raise ValueError(f'could not find example sentences for "{self.hanzi}"')
-
-    def get_random_example_sentences(self, how_many: int) -> list[str]:
-        """
-        Returns a list comprising a random sample of example sentences,
-        or an empty list of no example sentences are available.
-
-        :param how_many: Number of example sentences to return
-        :type how_many: int
-
-        :return: Returns a list of specified number (or fewer) example sentences
-        :rtype: list
-        """
-        try:
-            return random.sample(self.example_sentences, min(how_many, len(self.example_sentences)))
-        except (ValueError, TypeError):
-            return []
-
 
 class Book:
-    def __init__(self, title: str, text: str) -> None:
+    def __init__(self, title: str, text: str, max_example_sentences: int = 10) -> None:
         """
         Initialises new book.
 
@@ -86,6 +92,8 @@ class Book:
         :type title: str
         :param text: Book text
         :type text: str
+        :param max_example_sentences: Maximum number of example sentences kept for each hanzi, defaults to 10
+        :type max_example_sentences: int
 
         :raises ValueError: No hanzi found in text provided
 
@@ -94,9 +102,12 @@ class Book:
         """
         self.title = title
         self.text = text
+        self.max_example_sentences = max_example_sentences
         self.sentences = []
-        self.hanzi = {}  # key: hanzi string, value: Hanzi object
-        self.hanzi_sorted = ([], None, None)  # (sorted list of hanzi, reverse frequency, reverse distance)
+        self.hanzi = {}  # key: hanzi codepoint, value: Hanzi object
+        # (sorted list of hanzi, reverse frequency, reverse distance,
+        #  array of sorted hanzi's frequencies, array of running totals of those frequencies)
+        self.hanzi_sorted = ([], None, None, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
         self.total_hanzi = 0
         self.statistics = {}  # statistic_name: (statistic_heading, statistic_value)
         self.statistics_parameters = {'percentiles': [1, 2, 5, 10, 15, 20, 30, 40, 50, 60, 70, 80, 90, 95]}
@@ -106,6 +117,18 @@ class Book:
         except ValueError:
             raise
 
+    def __getstate__(self) -> dict:
+        """
+        Returns the book's attributes to be pickled, leaving out the text, which is only needed to prepare the book,
+        so that it is not passed between processes nor kept in the processed book cache along with the book.
+
+        :return: Returns the book's attributes, except its text
+        :rtype: dict
+        """
+        state = self.__dict__.copy()
+        state.pop('text', None)
+        return state
+
     def prepare_for_export(self) -> None:
         """
         Prepares the book for export.
@@ -138,48 +161,82 @@ class Book:
         """
         print(f'- finding and processing all unique hanzi in "{self.title}"')
 
-        # find all unique hanzi in book
+        # find all unique hanzi in book, scanning chunks of the text in parallel
+        # (numpy releases the GIL, so threads suffice and the text need not be copied to other processes)
         self.hanzi.clear()
-        for index, character in enumerate(self.text):
-            if re.fullmatch('[\u4e00-\u9fff]', character):  # \u4e00-\u9fff is unicode range for Chinese characters
-                if character not in self.hanzi:
-                    self.hanzi[character] = Hanzi(character)
-                else:
-                    self.hanzi[character].frequency += 1
-                self.hanzi[character].occurrences.append(index)
+        chunks = [(self.text[start:start + SCAN_CHUNK_SIZE], start)
+                  for start in range(0, len(self.text) or 1, SCAN_CHUNK_SIZE)]
+        if len(chunks) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(chunks), os.cpu_count() or 1)) as executor:
+                scans = list(executor.map(lambda chunk: _scan_hanzi(*chunk), chunks))
+        else:
+            scans = [_scan_hanzi(*chunks[0])]
+        # chunks are merged in order, so the indices of the occurrences stay in ascending order
+        hanzi_offsets = np.concatenate([offsets for offsets, _ in scans])
+        positions = np.concatenate([chunk_positions for _, chunk_positions in scans])
+        # count each hanzi and group the indices of its occurrences (a stable sort of 16-bit keys is a radix sort)
+        counts = np.bincount(hanzi_offsets, minlength=LAST_HANZI - FIRST_HANZI + 1)
+        found_offsets = np.flatnonzero(counts)
+        found_counts = counts[found_offsets]
+        ends = np.cumsum(found_counts)
+        grouped_positions = positions[np.argsort(hanzi_offsets, kind='stable')]
+        occurrences = np.split(grouped_positions, ends[:-1])
+        # add hanzi in order of first occurrence
+        for i in np.argsort(grouped_positions[ends - found_counts]):
+            codepoint = FIRST_HANZI + int(found_offsets[i])
+            self.hanzi[codepoint] = Hanzi(chr(codepoint), int(found_counts[i]))
+            self.hanzi[codepoint].occurrences = occurrences[i]
         # if no hanzi found, book is not in Chinese
         if len(self.hanzi) == 0:
             raise ValueError(f'no hanzi found in "{self.title}"')
 
         # split book into sentences
-        start_sentence = zhon.hanzi.characters + r'\w'
-        latin_non_stops = r'\.\-#(),;:%$&*+/<=>@\[\]^_`{|}~\\ '
-        mid_sentence = start_sentence + zhon.hanzi.radicals + zhon.hanzi.non_stops + r'─．○' + latin_non_stops
-        latin_stops = r'!?'
-        chinese_stops = zhon.hanzi.stops + r'…\n'
-        stops = chinese_stops + latin_stops
-        end_sentence = f'[{stops}][」﹂”』’》）］｝〕〗〙〛〉】]*'
-
-        self.sentences = [sentence.strip() for sentence in re.findall(
-            fr'([{start_sentence}]+[{mid_sentence}]*{end_sentence})',
-            self.text
-        )]
+        self.sentences = [match.group().strip() for match in sentence_regex().finditer(self.text)]
 
         if len(self.sentences) == 0:
             raise ValueError(f'no valid sentences found in {self.title}')
 
         for hanzi in self.hanzi.values():
-            getattr(hanzi, 'calculate_average_distance')()
-            try:
-                getattr(hanzi, 'find_example_sentences')(self.sentences)
-            except ValueError:
-                raise
+            hanzi.calculate_average_distance()
+        try:
+            self.find_example_sentences()
+        except ValueError:
+            raise
 
         print(f'- found and processed all unique hanzi in "{self.title}"')
 
+    def find_example_sentences(self) -> None:
+        """
+        Finds example sentences for all the unique hanzi in the book. Each sentence is visited once
+        and offered to every hanzi it contains, each of which keeps a uniformly random sample of
+        at most self.max_example_sentences of the sentences it is offered (reservoir sampling).
+
+        :raises ValueError: No example sentences found for a hanzi
+
+        :return: None
+        :rtype: None
+        """
+        # codepoints of the hanzi in each sentence
+        sentence_hanzi = [frozenset(filter(self.hanzi.__contains__, map(ord, sentence))) for sentence in self.sentences]
+        for index, hanzi_in_sentence in enumerate(sentence_hanzi):
+            for codepoint in hanzi_in_sentence:
+                hanzi = self.hanzi[codepoint]
+                hanzi.sentence_count += 1
+                if len(hanzi.example_sentences) < self.max_example_sentences:
+                    hanzi.example_sentences.append(index)
+                else:
+                    # replace a kept sentence with probability max_example_sentences / sentence_count
+                    replaced = random.randrange(hanzi.sentence_count)
+                    if replaced < self.max_example_sentences:
+                        hanzi.example_sentences[replaced] = index
+        for hanzi in self.hanzi.values():
+            if hanzi.sentence_count == 0:
+                raise ValueError(f'could not find example sentences for "{hanzi.hanzi}"')
+
     def sort_hanzi(self, frequency_reversed: bool = True, distance_reversed: bool = True) -> None:
         """
-        Sorts self.hanzi. Assigns (sorted_list, frequency_order, distance_order) to self.hanzi_sorted.
+        Sorts self.hanzi. Assigns (sorted_list, frequency_order, distance_order, sorted_frequencies,
+        cumulative_frequencies) to self.hanzi_sorted.
 
         :param frequency_reversed: Reverse frequency, defaults to `True`
         :type frequency_reversed: bool
@@ -196,13 +253,62 @@ class Book:
             print(f'- sorting hanzi in {self.title} '
                   f'(frequency_reversed: {frequency_reversed}; distance_reversed: {distance_reversed})')
             hanzi_list = list(self.hanzi.values())
-            for key, reverse in reversed((('frequency', frequency_reversed), ('distance', distance_reversed))):
-                hanzi_list.sort(key=lambda hz: getattr(hz, key), reverse=reverse)
-            self.hanzi_sorted = (hanzi_list, frequency_reversed, distance_reversed)
+            # sort by frequency, then distance, in a single pass by negating whichever is reversed
+            frequency_sign = -1 if frequency_reversed else 1
+            distance_sign = -1 if distance_reversed else 1
+            hanzi_list.sort(key=lambda hz: (frequency_sign * hz.frequency, distance_sign * hz.distance))
+            frequencies = np.fromiter((hz.frequency for hz in hanzi_list), dtype=np.int64, count=len(hanzi_list))
+            self.hanzi_sorted = (hanzi_list, frequency_reversed, distance_reversed, frequencies,
+                                 np.cumsum(frequencies))
             print(f'- sorted hanzi in "{self.title}"')
 
     @staticmethod
-    def export_csv(path: str, filename: str, hanzi_to_export: list[Hanzi], example_sentences: int) -> None:
+    def get_random_example_sentences(hanzi_list: list[Hanzi], sentences: list[str], how_many: int) -> list[list[str]]:
+        """
+        Returns a random sample of example sentences for every hanzi in a list of hanzi. All the samples are
+        drawn at once: sorting a row of random keys gives a random permutation of one hanzi's example sentences.
+
+        :param hanzi_list: List of hanzi for which to return example sentences
+        :type hanzi_list: list
+        :param sentences: Sentences of the book to which the hanzi belong
+        :type sentences: list
+        :param how_many: Number of example sentences to return for each hanzi
+        :type how_many: int
+
+        :return: Returns a list with a list of the specified number (or fewer) example sentences for each hanzi
+        :rtype: list
+        """
+        if how_many <= 0:
+            return [[] for _ in hanzi_list]
+        lengths = np.fromiter((len(hz.example_sentences) for hz in hanzi_list), dtype=np.int64, count=len(hanzi_list))
+        keys = np.random.default_rng().random((len(hanzi_list), int(lengths.max(initial=0))))
+        # padding beyond each hanzi's example sentences sorts last
+        keys[np.arange(keys.shape[1]) >= lengths[:, None]] = np.inf
+        samples = np.argsort(keys, axis=1)[:, :how_many].tolist()
+        return [[sentences[hanzi.example_sentences[i]] for i in sample[:length]]
+                for hanzi, sample, length in zip(hanzi_list, samples, lengths.tolist())]
+
+    @staticmethod
+    def hanzi_csv_rows(hanzi_list: list[Hanzi], sentences: list[str], example_sentences: int) -> list[list]:
+        """
+        Builds the CSV rows (hanzi, frequency, distance and random example sentences) of a list of hanzi.
+
+        :param hanzi_list: List of hanzi
+        :type hanzi_list: list
+        :param sentences: Sentences of the book to which the hanzi belong
+        :type sentences: list
+        :param example_sentences: Number of example sentences
+        :type example_sentences: int
+
+        :return: Returns a row for each hanzi, in the order given
+        :rtype: list
+        """
+        examples = Book.get_random_example_sentences(hanzi_list, sentences, example_sentences)
+        return [[hanzi.hanzi, hanzi.frequency, hanzi.distance, *hanzi_examples]
+                for hanzi, hanzi_examples in zip(hanzi_list, examples)]
+
+    @staticmethod
+    def export_csv(path: str, filename: str, hanzi_rows: list[list], example_sentences: int) -> None:
         """
         Exports CSV.
 
@@ -210,8 +316,8 @@ class Book:
         :type path: str
         :param filename: CSV filename
         :type filename: str
-        :param hanzi_to_export: List of hanzi to export
-        :type hanzi_to_export: list
+        :param hanzi_rows: Rows of the hanzi to export (see hanzi_csv_rows)
+        :type hanzi_rows: list
         :param example_sentences: Number of example sentences
         :type example_sentences: int
 
@@ -220,24 +326,44 @@ class Book:
         :return: None
         :rtype: None
         """
+        # build the whole CSV in memory so that it is written to the file in one go
+        buffer = io.StringIO(newline='')
+        csv_writer = csv.writer(buffer)
+        headings = ['hanzi', 'freq', 'dist']
+        for i in range(1, example_sentences + 1):
+            headings.append(f'ex{i}')
+        csv_writer.writerow(headings)
+        csv_writer.writerows(hanzi_rows)
         try:
             with open(os.path.join(path, filename), 'w', newline='', encoding='utf_8_sig') as f:
-                csv_writer = csv.writer(f)
-                headings = ['hanzi', 'freq', 'dist']
-                for i in range(1, example_sentences + 1):
-                    headings.append(f'ex{i}')
-                csv_writer.writerow(headings)
-                for hanzi in hanzi_to_export:
-                    entry = [getattr(hanzi, 'hanzi'), getattr(hanzi, 'frequency'), getattr(hanzi, 'distance')]
-                    examples = getattr(hanzi, 'get_random_example_sentences')(example_sentences)
-                    entry.extend(examples)
-                    csv_writer.writerow(entry)
+                f.write(buffer.getvalue())
         except IOError:
             print(f'- could not export "{filename}" to "{path}"')
             raise
 
+    def compute_unique_hanzi(self, frequency_reversed: bool = True, distance_reversed: bool = True,
+                             example_sentences: int = 0) -> list[list]:
+        """
+        Sorts the unique hanzi and builds their CSV rows, so that they can be shared by the
+        unique hanzi and hanzi to learn exports.
+
+        :param frequency_reversed: Reverse frequency, defaults to `True`
+        :type frequency_reversed: bool
+        :param distance_reversed: Reverse distance, defaults to `True`
+        :type distance_reversed: bool
+        :param example_sentences: Number of example sentences, defaults to 0
+        :type example_sentences: int
+
+        :return: Returns the rows of all the unique hanzi, sorted
+        :rtype: list
+        """
+        # only sort self.hanzi if not already sorted in the specified order
+        if self.hanzi_sorted[1] != frequency_reversed or self.hanzi_sorted[2] != distance_reversed:
+            self.sort_hanzi(frequency_reversed, distance_reversed)
+        return Book.hanzi_csv_rows(self.hanzi_sorted[0], self.sentences, example_sentences)
+
     def export_unique_hanzi(self, path: str, frequency_reversed: bool = True, distance_reversed: bool = True,
-                            example_sentences: int = 0) -> None:
+                            example_sentences: int = 0, unique_hanzi: list[list] | None = None) -> None:
         """
         Exports sorted unique hanzi as CSV.
 
@@ -249,26 +375,28 @@ class Book:
         :type distance_reversed: bool
         :param example_sentences: Number of example sentences, defaults to 0
         :type example_sentences: int
+        :param unique_hanzi: Rows returned by compute_unique_hanzi with the same arguments, defaults to `None`
+            (computed here)
+        :type unique_hanzi: list | None
 
         :raises IOError: Path not writable
 
         :return: None
         :rtype: None
         """
-        # only sort self.hanzi if not already sorted in the specified order
-        if self.hanzi_sorted[1] != frequency_reversed or self.hanzi_sorted[2] != distance_reversed:
-            self.sort_hanzi(frequency_reversed, distance_reversed)
+        if unique_hanzi is None:
+            unique_hanzi = self.compute_unique_hanzi(frequency_reversed, distance_reversed, example_sentences)
         print(f'- exporting unique hanzi in "{self.title}" '
               f'(frequency_reversed: {frequency_reversed}; distance_reversed: {distance_reversed})')
         try:
-            Book.export_csv(path, f'{self.title}_hanzi.csv', self.hanzi_sorted[0], example_sentences)
+            Book.export_csv(path, f'{self.title}_hanzi.csv', unique_hanzi, example_sentences)
         except IOError:
             raise
         print(f'- exported unique hanzi in "{self.title}" to "{path}"')
 
     def export_hanzi_to_learn(self, path: str, comprehension_percentage: int, frequency_threshold: int,
                               example_sentences: int, frequency_reversed: bool = True,
-                              distance_reversed: bool = True) -> None:
+                              distance_reversed: bool = True, unique_hanzi: list[list] | None = None) -> None:
         """
         Determines which hanzi to learn based on the desired comprehension
         percentage and frequency threshold, and exports them, along with
@@ -286,6 +414,9 @@ class Book:
         :type frequency_reversed: bool
         :param distance_reversed: Reverse distance, defaults to `True`
         :type distance_reversed: bool
+        :param unique_hanzi: Rows returned by compute_unique_hanzi with the same sort order and number of
+            example sentences, from which to take the rows of the hanzi to learn, defaults to `None` (computed here)
+        :type unique_hanzi: list | None
 
         :raises IOError: Path not writable
 
@@ -296,27 +427,37 @@ class Book:
               f'frequency_threshold: {frequency_threshold}; example_sentences: {example_sentences}; '
               f'frequency_reversed: {frequency_reversed}; distance_reversed: {distance_reversed})')
 
-        # sum frequency of hanzi up to last_hanzi_index as percentage of book text in percentage_of_total
+        # find the number of hanzi, last_hanzi_index, whose summed frequency as a percentage
+        # of the book text reaches the comprehension percentage
         self.sort_hanzi(frequency_reversed, distance_reversed)
-        last_hanzi_index = 0
         if comprehension_percentage != 100:
-            percentage_of_total = 0.0
-            while round(percentage_of_total, 2) < float(comprehension_percentage):
-                percentage_of_total += getattr(self.hanzi_sorted[0][last_hanzi_index],
-                                               'frequency') / self.total_hanzi * 100
-                last_hanzi_index += 1
+            percentages_of_total = np.round(self.hanzi_sorted[4] * 100 / self.total_hanzi, 2)
+            last_hanzi_index = int(np.searchsorted(percentages_of_total, float(comprehension_percentage))) + 1
         else:
             last_hanzi_index = len(self.hanzi_sorted[0]) - 1
 
         # find first hanzi with specified threshold frequency (or lower, if no exact match)
-        first_hanzi_index = index_of_first(self.hanzi_sorted[0],
-                                           lambda x: getattr(x, 'frequency') <= frequency_threshold)
+        if frequency_reversed:
+            # binary search the frequencies, reversed into ascending order, for those above the threshold
+            frequencies = self.hanzi_sorted[3]
+            first_hanzi_index = len(frequencies) - int(np.searchsorted(frequencies[::-1], frequency_threshold,
+                                                                       side='right'))
+            if first_hanzi_index == len(frequencies):
+                first_hanzi_index = -1
+        else:
+            first_hanzi_index = index_of_first(self.hanzi_sorted[0],
+                                               lambda x: x.frequency <= frequency_threshold)
 
         # hanzi_to_learn comprises the hanzi with the specified frequency threshold
         # or below, until the specified comprehension percentage is attainable, but
         # if first_z_ind is -1 (returned by index_of_first if no match is found) or greater,
         # than last_hanzi_index, hanzi_to_learn will be empty because of how Python handles slicing
-        hanzi_to_learn = self.hanzi_sorted[0][first_hanzi_index:last_hanzi_index + 1]
+        if unique_hanzi is not None:
+            # the rows of the unique hanzi are in the same order as the sorted hanzi
+            hanzi_to_learn = unique_hanzi[first_hanzi_index:last_hanzi_index + 1]
+        else:
+            hanzi_to_learn = Book.hanzi_csv_rows(self.hanzi_sorted[0][first_hanzi_index:last_hanzi_index + 1],
+                                                 self.sentences, example_sentences)
 
         print(f'- hanzi to learn: {len(hanzi_to_learn)}')
         try:
@@ -344,20 +485,21 @@ class Book:
         :rtype: None
         """
         print('- exporting shared hanzi csv')
-        # list of unique hanzi in each book
-        book_hanzi = [book.hanzi.keys() for book in books]
-        # find hanzi in common
-        shared_hanzi = set.intersection(*map(set, book_hanzi))
+        # find hanzi in common, in the order in which they first occur in the first book
+        shared_hanzi = [codepoint for codepoint in books[0].hanzi
+                        if all(codepoint in book.hanzi for book in books[1:])]
+        # frequencies[i, j] is the frequency of shared_hanzi[j] in books[i]
+        frequencies = np.array([[book.hanzi[codepoint].frequency for codepoint in shared_hanzi] for book in books],
+                               dtype=np.int64).reshape(len(books), len(shared_hanzi))
         # sum up the frequency of each shared hanzi
-        total_frequency = {hanzi: sum(getattr(book, 'hanzi')[hanzi].frequency for book in books)
-                           for hanzi in shared_hanzi}
-        # sort dictionary of shared hanzi
-        total_frequency_sorted = sorted(total_frequency.items(), key=lambda hz: hz[1], reverse=frequency_reversed)
+        total_frequencies = frequencies.sum(axis=0)
+        # sort shared hanzi by their summed frequencies (a stable sort, so ties keep their order either way)
+        order = np.argsort(-total_frequencies if frequency_reversed else total_frequencies, kind='stable')
         try:
             with open(os.path.join(path, 'shared-hanzi.csv'), 'w', newline='', encoding='utf_8_sig') as f:
-                f.write(f'hanzi,frequency\n')
-                for hanzi, frequency in total_frequency_sorted:
-                    f.write(f'{hanzi},{frequency}\n')
+                csv_writer = csv.writer(f)
+                csv_writer.writerow(['hanzi', 'frequency'])
+                csv_writer.writerows(zip([chr(shared_hanzi[i]) for i in order], total_frequencies[order].tolist()))
         except IOError:
             raise
         print(f'- exported shared hanzi csv to "{path}"')
@@ -373,8 +515,12 @@ class Book:
 
         print(f'- calculating statistics for "{self.title}"')
 
+        # running totals of the frequencies of the hanzi, from most to least frequent
+        self.sort_hanzi()
+        cumulative_frequencies = self.hanzi_sorted[4]
+
         # total number of hanzi
-        self.total_hanzi = sum(getattr(hz, 'frequency') for hz in self.hanzi_sorted[0])
+        self.total_hanzi = int(cumulative_frequencies[-1])
         self.statistics['total hanzi'] = ('total hanzi', f'{self.total_hanzi:d}')
 
         # total number of unique hanzi
@@ -382,13 +528,12 @@ class Book:
         self.statistics['unique hanzi'] = (f'total unique hanzi', f'{tally_unique_hanzi:d}')
 
         # hanzi percentiles as percentage of total number of hanzi
-        self.sort_hanzi()
         hanzi_percentiles_as_percentage_of_total = {}
         for i in self.statistics_parameters['percentiles']:
             index_of_hanzi_at_percentile = round(i / 100 * len(self.hanzi_sorted[0]))
-            hanzi_percentiles_as_percentage_of_total[i] = sum(
-                getattr(hanzi, 'frequency') for hanzi in
-                self.hanzi_sorted[0][:index_of_hanzi_at_percentile]) / self.total_hanzi
+            hanzi_percentiles_as_percentage_of_total[i] = (
+                int(cumulative_frequencies[index_of_hanzi_at_percentile - 1])
+                if index_of_hanzi_at_percentile > 0 else 0) / self.total_hanzi
             self.statistics[f'percentile {i} percentage'] = (f'top {i}% of hanzi as % of book',
                                                              f'{hanzi_percentiles_as_percentage_of_total[i]:%}')
             self.statistics[f'percentile {i} number'] = (f'no. hanzi in top {i}% of unique hanzi',
@@ -425,9 +570,8 @@ class Book:
         try:
             with open(os.path.join(path, f'{self.title}_stats.csv'), 'w', newline='',
                       encoding='utf_8_sig') as stats_csv:
-                headings, values = map(list, zip(*statistics_to_export))
-                stats_csv.write(','.join(headings) + '\n')
-                stats_csv.write(','.join(values) + '\n')
+                csv_writer = csv.writer(stats_csv)
+                csv_writer.writerows(zip(*statistics_to_export))
         except IOError:
             raise
         print(f'- exported statistics for "{self.title}" to "{path}"')
@@ -473,9 +617,27 @@ class Book:
             csv_values.append(stat_values)
         try:
             with open(os.path.join(path, 'combined-stats.csv'), 'w', newline='', encoding='utf_8_sig') as stats_csv:
-                stats_csv.write(','.join(csv_headings) + '\n')
-                for book_stats in csv_values:
-                    stats_csv.write(','.join(book_stats) + '\n')
+                csv_writer = csv.writer(stats_csv)
+                csv_writer.writerow(csv_headings)
+                csv_writer.writerows(csv_values)
         except IOError:
             raise
         print(f'- exported combined statistics to {path}')
+
+
+def _scan_hanzi(text: str, offset: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the hanzi in a chunk of a book's text.
+
+    :param text: Chunk of text
+    :type text: str
+    :param offset: Index of the start of the chunk in the book's text
+    :type offset: int
+
+    :return: Returns an array of the hanzi's codepoints, less FIRST_HANZI, and an array of their indices in the book
+    :rtype: tuple
+    """
+    # utf-32 stores one codepoint per character, so array indices are also indices into the text
+    codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    positions = np.flatnonzero((codepoints >= FIRST_HANZI) & (codepoints <= LAST_HANZI))
+    return (codepoints[positions] - FIRST_HANZI).astype(np.uint16), (positions + offset).astype(np.int32)
@@ -5,19 +5,467 @@
 # Released under the terms of the GNU General Public Licence, version 3
 # <http://www.gnu.org/licenses/>
 
+from __future__ import annotations
+
 __license__ = 'GPL v3'
 __version__ = '0.1'
 __author__ = 'Waldo Luis Ribeiro'
 
+import atexit
+import concurrent.futures
+import contextlib
+import functools
 import io
+import mmap
+import multiprocessing
 import os
-import sys
+import pickle
+import shelve
+import threading
+from collections.abc import Callable, Iterator
+from typing import TYPE_CHECKING
 
-import PySimpleGUI as sg
+# PySimpleGUI (and tkinter) and book (and numpy) are slow to import, so they are only imported once needed: the
+# window is opened before the book module is loaded, and book loading processes never import the gui at all
+if TYPE_CHECKING:
+    import PySimpleGUI as sg
 
-from book import Book
+    from book import Book
 
+# processed books (or futures of books still being processed, since they were selected or exported), by title
 processed_books = {}
+# maximum number of threads writing export files at once
+EXPORT_THREADS = 8
+# held while the processed book cache is accessed, as books are prefetched and exported on different threads
+cache_lock = threading.Lock()
+# processes processing books, shared by all exports and prefetches (started when first needed), and held while the
+# pool is started, as it may be first needed by different threads at once
+book_processes = None
+book_pool_lock = threading.Lock()
+# export log of the current or last export, and whether an export is running
+export_log = []
+export_running = threading.Event()
+# elements of the window that are updated, by key (looked up once, when the window is set up)
+elements = {}
+# (modification time, book titles) of each book folder listed, by folder path
+folder_listings = {}
+# last disabled state set for each element, by key
+last_disabled = {}
+
+# keys of groups of window elements
+HANZI_SORT_OPT = ('-HANZI SORT FORW-', '-HANZI SORT REV-')
+DIST_SORT_OPT = ('-DIST SORT FORW-', '-DIST SORT REV-')
+LEARN_SLIDERS = ('-USG EX SPIN-', '-COMP PERC SPIN-', '-FREQ THRESH SPIN-')
+EXP_OPT = ('-EXP FILES HANZI-', '-EXP FILES LEARN-', '-EXP FILES BOTH-')
+HANZI_MODE_KEYS = ('-HANZI MODE NONE-', '-HANZI MODE IND-', '-HANZI MODE SHA-')
+STATS_MODE_KEYS = ('-STATS MODE NONE-', '-STATS MODE IND-', '-STATS MODE COM-')
+STATS_OPT_KEYS = ('-STATS OPT HANZI-', '-STATS OPT UNIQUE HANZI-', '-STATS OPT HANZI PERC-')
+HANZI_OPT = (*HANZI_SORT_OPT, *DIST_SORT_OPT, *LEARN_SLIDERS, *EXP_OPT)
+# export mode: {key of option: whether the option is disabled in that mode}
+HANZI_MODE_STATE = {
+    '-HANZI MODE NONE-': dict.fromkeys(HANZI_OPT, True),
+    '-HANZI MODE IND-': dict.fromkeys(HANZI_OPT, False),
+    '-HANZI MODE SHA-': {key: key not in HANZI_SORT_OPT for key in HANZI_OPT}
+}
+STATS_MODE_STATE = {mode: dict.fromkeys(STATS_OPT_KEYS, mode == '-STATS MODE NONE-') for mode in STATS_MODE_KEYS}
+# file export option: (export unique hanzi, export hanzi to learn)
+FILE_EXPORT_MAP = {0: (True, False), 1: (False, True), 2: (True, True)}
+# radio button: value of the export parameter it selects
+HANZI_MODE_TABLE = (('-HANZI MODE NONE-', 0), ('-HANZI MODE IND-', 1), ('-HANZI MODE SHA-', 2))
+FILE_EXPORT_TABLE = (('-EXP FILES HANZI-', 0), ('-EXP FILES LEARN-', 1), ('-EXP FILES BOTH-', 2))
+STATS_MODE_TABLE = (('-STATS MODE NONE-', 0), ('-STATS MODE IND-', 1), ('-STATS MODE COM-', 2))
+# most example sentences that can be exported for each hanzi, and so kept for each hanzi of a processed book
+MAX_EXAMPLE_SENTENCES = 10
+# values of the spin boxes (tk's Spinbox needs a sequence)
+USG_EX_RANGE = list(range(0, MAX_EXAMPLE_SENTENCES + 1))
+COMP_PERC_RANGE = list(range(90, 101))
+FREQ_THRESH_RANGE = list(range(10, 51))
+UPDATED_ELEMENT_KEYS = ('-BOOK LIST-', '-EXPORT BUTTON-', '-LOG-', *HANZI_OPT, *STATS_OPT_KEYS)
+
+
+@functools.lru_cache(maxsize=1)
+def book_cache() -> shelve.Shelf | dict:
+    """
+    Returns the cache of processed books kept between sessions, keyed by book path. Each entry is a tuple of the
+    book file's stamp (see book_stamp) and the pickled processed book. The cache is only opened the first time it is
+    requested, and is closed on exit. If it cannot be opened, its files are moved aside (with a .broken suffix) and a
+    new cache is started, and if that cannot be opened either, an empty dictionary is used instead.
+
+    :return: Returns the processed book cache
+    :rtype: shelve.Shelf | dict
+    """
+    from book import CACHE_PATH
+
+    cache_file_path = os.path.join(CACHE_PATH, 'books')
+    try:
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        cache = shelve.open(cache_file_path, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        # a damaged cache may raise almost any error, depending on the dbm module that wrote it (e.g. dbm.dumb, the
+        # default on windows, raises SyntaxError for a damaged index)
+        print(f'- could not open processed book cache: {e!r}')
+        try:
+            for file_name in os.listdir(CACHE_PATH):
+                if file_name.split('.')[0] == 'books' and not file_name.endswith('.broken'):
+                    os.replace(os.path.join(CACHE_PATH, file_name), os.path.join(CACHE_PATH, file_name + '.broken'))
+            cache = shelve.open(cache_file_path, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            print('- could not start a new processed book cache')
+            return {}
+        print('- started a new processed book cache')
+    atexit.register(close_book_cache, cache)
+    return cache
+
+
+def close_book_cache(cache: shelve.Shelf) -> None:
+    """
+    Closes the processed book cache once no other thread is using it, as an export may still be running on exit,
+    and closing the cache while it is being written would damage it.
+
+    :param cache: Processed book cache
+    :type cache: shelve.Shelf
+
+    :return: None
+    :rtype: None
+    """
+    with cache_lock:
+        cache.close()
+
+
+def cached_pickled_book(cache: shelve.Shelf | dict, book_path: str, stamp: tuple) -> bytes | None:
+    """
+    Looks a book up in the processed book cache, without unpickling it. The book is only returned if its file is
+    unchanged, so books pickled by an older version of Book are never unpickled.
+
+    :param cache: Processed book cache
+    :type cache: shelve.Shelf | dict
+    :param book_path: Book path
+    :type book_path: str
+    :param stamp: Book file's stamp (see book_stamp)
+    :type stamp: tuple
+
+    :raises Exception: Cache entry damaged (unpickling damaged data may raise almost any error)
+
+    :return: Returns the pickled book, or `None` if it is not cached or its file has changed since
+    :rtype: bytes | None
+    """
+    with cache_lock:
+        cached = cache.get(book_path)
+    if cached is None or cached[0] != stamp:
+        return None
+    return cached[1]
+
+
+def _load_book(book_title: str, book_path: str) -> tuple[Book | None, str, tuple | None]:
+    """
+    Reads and processes a book, capturing its log so that it can be printed by the process that requested the book.
+
+    :param book_title: Book title
+    :type book_title: str
+    :param book_path: Book path
+    :type book_path: str
+
+    :return: Returns the book (or `None` if it could not be accessed or processed), its log and the stamp of the file
+        it was read from (or `None` if it could not be accessed)
+    :rtype: tuple
+    """
+    from book import Book
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        new_book = None
+        stamp = None
+        try:
+            # read the whole file in one go, bypassing buffered io (and, on windows, newline translation)
+            fd = os.open(book_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                book_stat = os.fstat(fd)
+                stamp = book_stamp(book_stat)
+                # decode straight from the mapped file, without first copying it into a bytes object
+                if book_stat.st_size > 0:
+                    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped_file:
+                        text = str(mapped_file, 'utf-8')
+                else:
+                    # empty files cannot be mapped
+                    text = ''
+            finally:
+                os.close(fd)
+            # translate newlines as text mode would, copying the text only if there is anything to translate
+            if '\r' in text:
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+            new_book = Book(book_title, text, MAX_EXAMPLE_SENTENCES)
+        except IOError:
+            print(f'- could not access "{book_path}"')
+        except ValueError as e:
+            print(e)
+            print(f'- could not process "{book_title}"')
+    return new_book, log.getvalue(), stamp
+
+
+def book_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Returns the pool of processes processing books, one per CPU core. The pool is only started the first time it is
+    requested, and is reused by every later export and prefetch rather than started again for each, until it is shut
+    down by shutdown_book_pool or breaks (see submit_book). Its processes are spawned rather than forked, even where
+    forking is the default: they would otherwise be copies of the multi-threaded gui process, tkinter included.
+
+    :return: Returns the book processing pool
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+    global book_processes
+    with book_pool_lock:
+        if book_processes is None:
+            book_processes = concurrent.futures.ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 4, mp_context=multiprocessing.get_context('spawn'))
+        return book_processes
+
+
+def submit_book(book_title: str, book_path: str) -> concurrent.futures.Future:
+    """
+    Starts processing a book in the book processing pool. If a process of the pool died (e.g. killed for running out
+    of memory), which breaks the whole pool for good, the pool is replaced by a new one.
+
+    :param book_title: Book title
+    :type book_title: str
+    :param book_path: Book path
+    :type book_path: str
+
+    :return: Returns the future of the book (see _load_book)
+    :rtype: concurrent.futures.Future
+    """
+    global book_processes
+    executor = book_pool()
+    try:
+        return executor.submit(_load_book, book_title, book_path)
+    except concurrent.futures.process.BrokenProcessPool:
+        with book_pool_lock:
+            # unless another thread has already replaced it
+            if book_processes is executor:
+                book_processes = None
+        executor.shutdown(wait=False)
+        return book_pool().submit(_load_book, book_title, book_path)
+
+
+def book_stamp(book_stat: os.stat_result) -> tuple:
+    """
+    :param book_stat: Status of the book file
+    :type book_stat: os.stat_result
+
+    :return: Returns the book file's (modification time, size, cache version, example sentences kept)
+    :rtype: tuple
+    """
+    from book import CACHE_VERSION
+
+    return book_stat.st_mtime_ns, book_stat.st_size, CACHE_VERSION, MAX_EXAMPLE_SENTENCES
+
+
+def shutdown_book_pool() -> None:
+    """
+    Shuts down the book processing pool, if it was started, cancelling the books still waiting to be processed, and
+    without waiting for those already being processed. This cannot be left to atexit: concurrent.futures waits for
+    every queued book before atexit handlers are run.
+
+    :return: None
+    :rtype: None
+    """
+    if book_processes is not None:
+        book_processes.shutdown(wait=False, cancel_futures=True)
+
+
+def _start_book(cache: shelve.Shelf | dict, book_title: str, book_path: str, log_fn: Callable[[str], None] = print,
+                take_cached: bool = True) -> Book | concurrent.futures.Future | None:
+    """
+    Takes a book from the processed book cache if its file has not changed since it was cached, and otherwise starts
+    processing it in the book processing pool (see _finish_book). Damaged cache entries are removed, so that they are
+    replaced rather than failing again next time.
+
+    :param cache: Processed book cache
+    :type cache: shelve.Shelf | dict
+    :param book_title: Book title
+    :type book_title: str
+    :param book_path: Book path
+    :type book_path: str
+    :param log_fn: Function called with each line of the log, defaults to `print`
+    :type log_fn: Callable
+    :param take_cached: Whether to unpickle the book if it is cached, defaults to `True`. Otherwise, it is left in
+        the cache, e.g. so that the gui thread is not held up unpickling it.
+    :type take_cached: bool
+
+    :return: Returns the cached book (or `None` if it is cached but not taken), or the future of the book being
+        processed
+    :rtype: Book | concurrent.futures.Future | None
+    """
+    try:
+        stamp = book_stamp(os.stat(book_path))
+    except OSError:
+        # _load_book reports why the book cannot be accessed
+        stamp = None
+    if stamp is not None:
+        try:
+            pickled_book = cached_pickled_book(cache, book_path, stamp)
+            if pickled_book is not None:
+                if not take_cached:
+                    return None
+                cached_book = pickle.loads(pickled_book)
+                log_fn(f'- loaded "{book_title}" from processed book cache')
+                return cached_book
+        except Exception:
+            with cache_lock, contextlib.suppress(Exception):
+                del cache[book_path]
+            log_fn(f'- could not load "{book_title}" from processed book cache')
+    return submit_book(book_title, book_path)
+
+
+def _finish_book(cache: shelve.Shelf | dict, book_title: str, book_path: str, future: concurrent.futures.Future,
+                 log_fn: Callable[[str], None] = print) -> Book | None:
+    """
+    Takes in a book processed in the book processing pool (see _start_book), logging what was done to it and saving it
+    to the processed book cache. A book whose processing failed altogether (e.g. because the pool broke) is reported,
+    rather than ending the export of the other books.
+
+    :param cache: Processed book cache
+    :type cache: shelve.Shelf | dict
+    :param book_title: Book title
+    :type book_title: str
+    :param book_path: Book path
+    :type book_path: str
+    :param future: Future of the book, which must be done
+    :type future: concurrent.futures.Future
+    :param log_fn: Function called with each line of the log, defaults to `print`
+    :type log_fn: Callable
+
+    :return: Returns the book, or `None` if it could not be accessed or processed
+    :rtype: Book | None
+    """
+    try:
+        new_book, log, stamp = future.result()
+    except Exception as e:
+        log_fn(repr(e))
+        log_fn(f'- could not process "{book_title}"')
+        return None
+    for line in log.splitlines():
+        log_fn(line)
+    if new_book is not None and stamp is not None:
+        try:
+            pickled_book = pickle.dumps(new_book, protocol=pickle.HIGHEST_PROTOCOL)
+            with cache_lock:
+                cache[book_path] = (stamp, pickled_book)
+        except Exception:
+            log_fn(f'- could not save "{book_title}" to processed book cache')
+    return new_book
+
+
+def _prefetch_failed(processed_book: Book | concurrent.futures.Future) -> bool:
+    """
+    :param processed_book: Processed book, or future of a book being processed
+    :type processed_book: Book | concurrent.futures.Future
+
+    :return: Returns `True` if the book is a future that is done, without a book, and vice versa.
+    :rtype: bool
+    """
+    return (isinstance(processed_book, concurrent.futures.Future) and processed_book.done()
+            and (processed_book.cancelled() or processed_book.exception() is not None
+                 or processed_book.result()[0] is None))
+
+
+def prefetch_books(book_titles: list[str], book_folder_path: str) -> None:
+    """
+    Starts processing the given books that are not processed, being processed or cached yet, in the background.
+    Each book is sent straight to the book processing pool, so that all the selected books are processed at once.
+
+    :param book_titles: Book titles
+    :type book_titles: list
+    :param book_folder_path: Book folder path
+    :type book_folder_path: str
+
+    :return: None
+    :rtype: None
+    """
+    with cache_lock:
+        cache = book_cache()
+    for book_title in book_titles:
+        if book_title not in processed_books:
+            book_path = os.path.join(book_folder_path, book_title + '.txt')
+            future = _start_book(cache, book_title, book_path, take_cached=False)
+            if future is not None:
+                processed_books[book_title] = future
+
+
+def _export_hanzi_files(book: Book, export_folder_path: str, hanzi_export: tuple[bool, bool, int] | None,
+                        learn_export: tuple[int, int, int, bool, bool] | None, log_fn: Callable[[str], None]) -> None:
+    """
+    Exports a book's unique hanzi and/or hanzi to learn, one after the other (both sort the book's hanzi).
+    When both are exported in the same order with the same number of example sentences, the rows of the
+    unique hanzi are computed once and the hanzi to learn are taken from them.
+
+    :param book: Book
+    :type book: Book
+    :param export_folder_path: Export folder path
+    :type export_folder_path: str
+    :param hanzi_export: Arguments for Book.export_unique_hanzi, or `None` not to export unique hanzi
+    :type hanzi_export: tuple | None
+    :param learn_export: Arguments for Book.export_hanzi_to_learn, or `None` not to export hanzi to learn
+    :type learn_export: tuple | None
+    :param log_fn: Function called with the message of each export that failed
+    :type log_fn: Callable
+
+    :return: None
+    :rtype: None
+    """
+    unique_hanzi = None
+    if hanzi_export is not None:
+        unique_hanzi = book.compute_unique_hanzi(*hanzi_export)
+        try:
+            book.export_unique_hanzi(export_folder_path, *hanzi_export, unique_hanzi=unique_hanzi)
+        except IOError:
+            log_fn(f'- could not export unique hanzi in "{book.title}"')
+    if learn_export is not None:
+        # (frequency_reverse, distance_reverse, example_sentences) must match for the rows to be shared
+        if hanzi_export != (learn_export[3], learn_export[4], learn_export[2]):
+            unique_hanzi = None
+        try:
+            book.export_hanzi_to_learn(export_folder_path, *learn_export, unique_hanzi=unique_hanzi)
+        except IOError:
+            log_fn(f'- could not export hanzi to learn in "{book.title}"')
+
+
+def _export_statistics(book: Book, export_folder_path: str, stats_options: tuple[bool, bool, bool],
+                       log_fn: Callable[[str], None]) -> None:
+    """
+    Exports a book's statistics.
+
+    :param book: Book
+    :type book: Book
+    :param export_folder_path: Export folder path
+    :type export_folder_path: str
+    :param stats_options: Statistics to export
+    :type stats_options: tuple
+    :param log_fn: Function called with the message of the export if it failed
+    :type log_fn: Callable
+
+    :return: None
+    :rtype: None
+    """
+    try:
+        book.export_statistics(export_folder_path, stats_options)
+    except IOError:
+        log_fn(f'- could not export statistics for "{book.title}"')
+
+
+def _run_exports(exports: list[Callable[[], None]]) -> None:
+    """
+    Runs exports in a thread pool, so that the books' files are written concurrently
+    (file writes release the GIL). Each export must only touch its own book, and log its own failures.
+
+    :param exports: List of exports
+    :type exports: list
+
+    :return: None
+    :rtype: None
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(EXPORT_THREADS, len(exports))) as executor:
+        for future in concurrent.futures.as_completed([executor.submit(export) for export in exports]):
+            future.result()
 
 
 def export_books(book_file_names: list[str],
@@ -26,7 +474,8 @@ def export_books(book_file_names: list[str],
                  hanzi_export: tuple[int, bool, bool, int],
                  file_export: int,
                  learn_export: tuple[int, int, int, bool, bool],
-                 stats_export: tuple[int, tuple[bool, bool, bool]]) -> None:
+                 stats_export: tuple[int, tuple[bool, bool, bool]],
+                 log_fn: Callable[[str], None] = print) -> None:
     """
     :param book_file_names: Book filenames
     :type book_file_names:  list
@@ -50,110 +499,187 @@ def export_books(book_file_names: list[str],
         statistics, where stats_export_mode may be 0 (none), 1 (individual) or 2 (combined), and total_hanzi,
         unique_hanzi and hanzi_percentiles may be `True` or `False`.
     :type stats_export: tuple
+    :param log_fn: Function called with each line of the export log, defaults to `print`
+    :type log_fn: Callable
 
     :return: None
     :rtype: None
     """
+    from book import Book
+
     books_to_export = []
 
+    # books processed in an earlier session are taken from the cache if their files have not changed since, and the
+    # others are processed in parallel (unless they are already being processed, since they were selected)
+    with cache_lock:
+        cache = book_cache()
+    futures = {}
     for book_title in book_file_names:
-        if book_title not in processed_books:
-            book_path = os.path.join(book_folder_path, book_title + '.txt')
-            try:
-                with open(book_path) as book_file:
-                    new_book = Book(book_title, book_file.read())
-                    processed_books[book_title] = new_book
-                    books_to_export.append(new_book)
-                    print(f'- "{book_title}" added to processing list')
-            except IOError:
-                print(f'- could not access "{book_path}"')
-            except ValueError as e:
-                print(e)
-                print(f'- could not process "{book_title}"')
+        book_path = os.path.join(book_folder_path, book_title + '.txt')
+        processed_book = processed_books.get(book_title)
+        if processed_book is None or _prefetch_failed(processed_book):
+            # books that could not be prefetched are tried again, logging why they fail if they still do
+            processed_book = processed_books[book_title] = _start_book(cache, book_title, book_path, log_fn)
+        if isinstance(processed_book, concurrent.futures.Future):
+            futures[processed_book] = (book_title, book_path)
+
+    # books being processed are taken in as soon as each is done, whichever was started first
+    for future in concurrent.futures.as_completed(futures):
+        book_title, book_path = futures[future]
+        new_book = _finish_book(cache, book_title, book_path, future, log_fn)
+        if new_book is not None:
+            processed_books[book_title] = new_book
         else:
+            # tried again next time the book is selected or exported
+            del processed_books[book_title]
+
+    # books are exported in the order in which they were selected
+    for book_title in book_file_names:
+        if book_title in processed_books:
             books_to_export.append(processed_books[book_title])
-            print(f'- "{book_title}" added to processing list')
+            log_fn(f'- "{book_title}" added to processing list')
 
     if books_to_export:
-        print('- all selected books added to processing list')
+        log_fn('- all selected books added to processing list')
         # exporting hanzi in each individual book
         if hanzi_export[0] == 1:
-            for book in books_to_export:
-                # exporting list of unique hanzi
-                if file_export == 0:
-                    try:
-                        book.export_unique_hanzi(export_folder_path, hanzi_export[1], hanzi_export[2], hanzi_export[3])
-                    except IOError:
-                        print(f'- could not export unique hanzi in "{book.title}"')
-                # exporting hanzi to learn
-                elif file_export == 1:
-                    try:
-                        book.export_hanzi_to_learn(export_folder_path, *learn_export)
-                    except IOError:
-                        print(f'- could not export hanzi to learn in "{book.title}"')
-                # exporting both
-                else:
-                    try:
-                        book.export_unique_hanzi(export_folder_path, hanzi_export[1], hanzi_export[2], hanzi_export[3])
-                        book.export_hanzi_to_learn(export_folder_path, *learn_export)
-                    except IOError:
-                        print(f'- could not export unique hanzi or hanzi to learn in "{book.title}"')
+            export_unique, export_learn = FILE_EXPORT_MAP[file_export]
+            _run_exports([functools.partial(_export_hanzi_files, book, export_folder_path,
+                                            hanzi_export[1:] if export_unique else None,
+                                            learn_export if export_learn else None, log_fn)
+                          for book in books_to_export])
         # exporting hanzi shared by all selected books
         elif hanzi_export[0] == 2:
             try:
                 Book.export_shared_hanzi(books_to_export, export_folder_path, hanzi_export[1])
             except IOError:
-                print('- could not export shared hanzi')
+                log_fn('- could not export shared hanzi')
         # exporting a single file with the statistics of all the selected books
         if stats_export[0] == 2:
             try:
                 Book.export_combined_statistics_csv(books_to_export, export_folder_path, stats_export[1])
             except IOError:
-                print('- could not export combined statistics')
+                log_fn('- could not export combined statistics')
         # exporting the statistics of each selected book individually
         elif stats_export[0] == 1:
-            for book in books_to_export:
-                try:
-                    book.export_statistics(export_folder_path, stats_export[1])
-                except IOError:
-                    print(f'- could not export statistics for "{book.title}"')
+            _run_exports([functools.partial(_export_statistics, book, export_folder_path, stats_export[1], log_fn)
+                          for book in books_to_export])
     else:
-        print('- no books to process')
+        log_fn('- no books to process')
 
 
-def disable_export_button(book_list: list[str], export_path: str, hanzi_mode: tuple[bool, bool, bool],
-                          stats_mode: tuple[bool, bool, bool], stats_options: tuple[bool, bool, bool]) -> bool:
+def disable_export_button(values: dict) -> bool:
     """
-    Decides whether to disable the export button.
+    Decides whether to disable the export button, reading the values it depends on straight from the window's.
+    The button stays disabled while an export is running, as only one export runs at a time.
 
-    :param book_list: List of books in the book list
-    :type book_list: list
-    :param export_path: Export path
-    :type export_path: str
-    :param hanzi_mode: Hanzi export mode
-    :type hanzi_mode: tuple
-    :param stats_mode: Statistics export mode
-    :type stats_mode: tuple
-    :param stats_options: Statistics export options
-    :type stats_options: tuple
+    :param values: Values of the window's elements
+    :type values: dict
 
     :return: Returns `True` if export button should be disabled, and vice versa.
     :rtype: bool
     """
-    if len(book_list) == 0:
+    book_list = values['-BOOK LIST-']
+    if export_running.is_set():
+        return True
+    elif len(book_list) == 0:
         return True
-    elif len(export_path) == 0:
+    elif len(values['-EXPORT PATH-']) == 0:
         return True
-    elif hanzi_mode[0] and stats_mode[0]:
+    elif values['-HANZI MODE NONE-'] and values['-STATS MODE NONE-']:
         return True
-    elif len(book_list) == 1 and (hanzi_mode[2] or stats_mode[2]):
+    elif len(book_list) == 1 and (values['-HANZI MODE SHA-'] or values['-STATS MODE COM-']):
         return True
-    elif (stats_mode[1] or stats_mode[2]) and (True not in stats_options):
+    elif (values['-STATS MODE IND-'] or values['-STATS MODE COM-']) and not (
+            values['-STATS OPT HANZI-'] or values['-STATS OPT UNIQUE HANZI-'] or values['-STATS OPT HANZI PERC-']):
         return True
     return False
 
 
+class EventWriter(io.TextIOBase):
+    """
+    Text stream that sends everything written to it to a window as events, so that a thread other than the GUI
+    thread can report its progress. Text is sent a whole line at a time, and each thread's text is kept apart,
+    so that lines printed by concurrent threads are never mixed up.
+    """
+
+    def __init__(self, window: sg.Window, key: str):
+        """
+        :param window: Window to send events to
+        :type window: sg.Window
+        :param key: Key of the events
+        :type key: str
+
+        :return: None
+        :rtype: None
+        """
+        super().__init__()
+        self.window = window
+        self.key = key
+        self.pending = threading.local()  # each thread's text not yet ended by a newline
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        """
+        Sends the complete lines of text to the window as the value of an event, keeping the rest until
+        the line is ended.
+
+        :param text: Text to send
+        :type text: str
+
+        :return: Returns the number of characters written
+        :rtype: int
+        """
+        pending = getattr(self.pending, 'text', '') + text
+        end_of_lines = pending.rfind('\n') + 1
+        if end_of_lines:
+            self.window.write_event_value(self.key, pending[:end_of_lines])
+        self.pending.text = pending[end_of_lines:]
+        return len(text)
+
+    def flush(self) -> None:
+        """
+        Sends the calling thread's unfinished line to the window, if there is one.
+
+        :return: None
+        :rtype: None
+        """
+        pending = getattr(self.pending, 'text', '')
+        if pending:
+            self.window.write_event_value(self.key, pending)
+            self.pending.text = ''
+
+
+def export_books_in_background(window: sg.Window, *export_arguments) -> None:
+    """
+    Exports books (see export_books), sending the export log to the window as '-EXPORT LOG-' events.
+    Meant to be run outside the GUI thread, e.g. with window.perform_long_operation.
+
+    :param window: Window to send the export log to
+    :type window: sg.Window
+    :param export_arguments: Arguments for export_books
+    :type export_arguments: tuple
+
+    :return: None
+    :rtype: None
+    """
+    event_writer = EventWriter(window, '-EXPORT LOG-')
+    try:
+        # books still print what they are doing
+        with contextlib.redirect_stdout(event_writer):
+            export_books(*export_arguments, log_fn=lambda line: event_writer.write(f'{line}\n'))
+    except Exception as e:
+        # returning normally is what sends '-EXPORT DONE-', without which no other export could be started
+        event_writer.write(f'{e!r}\n- could not finish export\n')
+    finally:
+        event_writer.flush()
+
+
 def setup_window() -> sg.Window:
+    import PySimpleGUI as sg
+
     path_frame = [
         [
             sg.Text("Books:"),
@@ -199,6 +725,14 @@ def setup_window() -> sg.Window:
                                  disabled=True,
                                  key='-EXPORT BUTTON-'
                              )
+                         ],
+                         [
+                             sg.Multiline(
+                                 size=(60, 10),
+                                 disabled=True,
+                                 autoscroll=True,
+                                 key='-LOG-'
+                             )
                          ]
                      ]
                      )
@@ -300,15 +834,15 @@ def setup_window() -> sg.Window:
     learn_frame = [
         [
             sg.Text('Usage examples:', size=16),
-            sg.Spin(values=[i for i in range(0, 11)], initial_value=2, size=4, key='-USG EX SPIN-')
+            sg.Spin(values=USG_EX_RANGE, initial_value=2, size=4, key='-USG EX SPIN-')
         ],
         [
             sg.Text('Comprehension:', size=16),
-            sg.Spin(values=[i for i in range(90, 101)], initial_value=98, size=4, key='-COMP PERC SPIN-')
+            sg.Spin(values=COMP_PERC_RANGE, initial_value=98, size=4, key='-COMP PERC SPIN-')
         ],
         [
             sg.Text('Frequency threshold:', size=16),
-            sg.Spin(values=[i for i in range(10, 51)], initial_value=20, size=4, key='-FREQ THRESH SPIN-')
+            sg.Spin(values=FREQ_THRESH_RANGE, initial_value=20, size=4, key='-FREQ THRESH SPIN-')
         ]
     ]
 
@@ -406,8 +940,264 @@ def setup_window() -> sg.Window:
     return sg.Window('Chinese Book Analyser', layout)
 
 
+def set_disabled(states: dict[str, bool]) -> None:
+    """
+    Disables or enables window elements, skipping those already in the requested state.
+
+    :param states: Whether to disable each element, by key
+    :type states: dict
+
+    :return: None
+    :rtype: None
+    """
+    for key, disabled in states.items():
+        if last_disabled.get(key) != disabled:
+            elements[key].update(disabled=disabled)
+            last_disabled[key] = disabled
+
+
+def update_export_button(values: dict) -> None:
+    """
+    Enables or disables the export button, depending on the values of the window's elements.
+
+    :param values: Values of the window's elements
+    :type values: dict
+
+    :return: None
+    :rtype: None
+    """
+    set_disabled({'-EXPORT BUTTON-': disable_export_button(values)})
+
+
+def list_book_titles(folder: str) -> list[str]:
+    """
+    Lists the titles of the books (.txt files) in a folder. The titles are remembered until the folder's
+    modification time changes, which it does whenever a file is added to, removed from or renamed in the folder.
+
+    :param folder: Book folder path
+    :type folder: str
+
+    :return: Returns the titles of the books in the folder
+    :rtype: list
+    """
+    modification_time = os.stat(folder).st_mtime_ns
+    cached = folder_listings.get(folder)
+    if cached is not None and cached[0] == modification_time:
+        return cached[1]
+    # get list of .txt files in folder (scandir's entries already know their type, so need no stat)
+    with os.scandir(folder) as entries:
+        titles = [
+            entry.name[:-4] for entry in entries
+            if entry.name.lower().endswith('.txt') and entry.is_file()
+        ]
+    folder_listings[folder] = (modification_time, titles)
+    return titles
+
+
+def _handle_book_path(window: sg.Window, values: dict, event: str) -> None:
+    """
+    Import folder was selected: lists the .txt files in it in the book list.
+
+    :param window: Window
+    :type window: sg.Window
+    :param values: Values of the window's elements
+    :type values: dict
+    :param event: Event ('-BOOK PATH-')
+    :type event: str
+
+    :return: None
+    :rtype: None
+    """
+    folder = values['-BOOK PATH-']
+    if folder:
+        # show list of .txt files in listbox with key -BOOK LIST-
+        elements['-BOOK LIST-'].update(list_book_titles(folder))
+
+
+def _handle_book_list(window: sg.Window, values: dict, event: str) -> None:
+    """
+    Book selection was altered: starts processing the newly selected books and updates the export button.
+
+    :param window: Window
+    :type window: sg.Window
+    :param values: Values of the window's elements
+    :type values: dict
+    :param event: Event ('-BOOK LIST-')
+    :type event: str
+
+    :return: None
+    :rtype: None
+    """
+    prefetch_books(values['-BOOK LIST-'], values['-BOOK PATH-'])
+    update_export_button(values)
+
+
+def _handle_export_criterion(window: sg.Window, values: dict, event: str) -> None:
+    """
+    Export folder or a statistics export option was altered: updates the export button.
+
+    :param window: Window
+    :type window: sg.Window
+    :param values: Values of the window's elements
+    :type values: dict
+    :param event: Event (key of the altered element)
+    :type event: str
+
+    :return: None
+    :rtype: None
+    """
+    update_export_button(values)
+
+
+def _handle_hanzi_mode(window: sg.Window, values: dict, event: str) -> None:
+    """
+    Hanzi export mode was altered: enables/disables the hanzi options the mode uses/does not use.
+
+    :param window: Window
+    :type window: sg.Window
+    :param values: Values of the window's elements
+    :type values: dict
+    :param event: Event (key of the selected mode's radio button)
+    :type event: str
+
+    :return: None
+    :rtype: None
+    """
+    set_disabled(HANZI_MODE_STATE[event])
+    update_export_button(values)
+
+
+def _handle_stats_mode(window: sg.Window, values: dict, event: str) -> None:
+    """
+    Statistics export mode was altered: enables/disables the statistics options.
+
+    :param window: Window
+    :type window: sg.Window
+    :param values: Values of the window's elements
+    :type values: dict
+    :param event: Event (key of the selected mode's radio button)
+    :type event: str
+
+    :return: None
+    :rtype: None
+    """
+    set_disabled(STATS_MODE_STATE[event])
+    update_export_button(values)
+
+
+def _handle_export_button(window: sg.Window, values: dict, event: str) -> bool:
+    """
+    Export button was selected: exports the selected books in the background.
+
+    :param window: Window
+    :type window: sg.Window
+    :param values: Values of the window's elements
+    :type values: dict
+    :param event: Event ('-EXPORT BUTTON-')
+    :type event: str
+
+    :return: Returns `True` if the export folder could not be created and the window should be closed
+    :rtype: bool
+    """
+    if len(values['-BOOK LIST-']) >= 1 and not export_running.is_set():
+        try:
+            os.makedirs(values['-EXPORT PATH-'], exist_ok=True)
+        except OSError as e:
+            print(f'could not create directory "{values["-EXPORT PATH-"]}": {e}')
+            return True
+
+        hanzi_export_mode = next((mode for key, mode in HANZI_MODE_TABLE if values[key]), 1)
+        file_export_option = next((option for key, option in FILE_EXPORT_TABLE if values[key]), 1)
+        hanzi_frequency_order = not values['-HANZI SORT FORW-']
+        hanzi_distance_order = not values['-DIST SORT FORW-']
+        stats_export_mode = next((mode for key, mode in STATS_MODE_TABLE if values[key]), 2)
+        stats_export_options = tuple(values[key] for key in STATS_OPT_KEYS)
+
+        comprehension_percentage = int(values['-COMP PERC SPIN-'])
+        frequency_threshold = int(values['-FREQ THRESH SPIN-'])
+        example_sentences = int(values['-USG EX SPIN-'])
+
+        # export in the background, so that the window stays responsive, and only one export at a time
+        export_running.set()
+        set_disabled({'-EXPORT BUTTON-': True})
+        elements['-LOG-'].update('')
+        export_log.clear()
+        window.perform_long_operation(functools.partial(
+            export_books_in_background,
+            window,
+            values['-BOOK LIST-'],
+            values['-BOOK PATH-'],
+            values['-EXPORT PATH-'],
+            (hanzi_export_mode, hanzi_frequency_order, hanzi_distance_order, example_sentences),
+            file_export_option,
+            (comprehension_percentage, frequency_threshold, example_sentences,
+             hanzi_frequency_order, hanzi_distance_order),
+            (stats_export_mode, stats_export_options)
+        ), '-EXPORT DONE-')
+    return False
+
+
+def _handle_export_log(window: sg.Window, values: dict, event: str) -> None:
+    """
+    Export progress was reported: appends it to the export log.
+
+    :param window: Window
+    :type window: sg.Window
+    :param values: Values of the window's elements
+    :type values: dict
+    :param event: Event ('-EXPORT LOG-', whose value is the progress reported)
+    :type event: str
+
+    :return: None
+    :rtype: None
+    """
+    export_log.append(values[event])
+    elements['-LOG-'].update(values[event], append=True)
+
+
+def _handle_export_done(window: sg.Window, values: dict, event: str) -> None:
+    """
+    Export finished: shows the export log.
+
+    :param window: Window
+    :type window: sg.Window
+    :param values: Values of the window's elements
+    :type values: dict
+    :param event: Event ('-EXPORT DONE-')
+    :type event: str
+
+    :return: None
+    :rtype: None
+    """
+    import PySimpleGUI as sg
+
+    export_running.clear()
+    update_export_button(values)
+    sg.popup_scrolled(''.join(export_log), title='Export Log', size=(50, 20))
+
+
+# event: handler(window, values, event), which returns `True` if the window should be closed
+HANDLERS = {
+    '-BOOK PATH-': _handle_book_path,
+    '-EXPORT PATH-': _handle_export_criterion,
+    '-BOOK LIST-': _handle_book_list,
+    '-EXPORT BUTTON-': _handle_export_button,
+    '-EXPORT LOG-': _handle_export_log,
+    '-EXPORT DONE-': _handle_export_done
+}
+# handlers of families of events, by event prefix
+PREFIX_HANDLERS = (
+    ('-HANZI MODE', _handle_hanzi_mode),
+    ('-STATS MODE', _handle_stats_mode),
+    ('-STATS OPT', _handle_export_criterion)
+)
+
+
 def main():
+    import PySimpleGUI as sg
+
     window = setup_window()
+    elements.update((key, window[key]) for key in UPDATED_ELEMENT_KEYS)
 
     while True:
         event, values = window.read()
@@ -415,150 +1205,15 @@ def main():
         if event == sg.WIN_CLOSED:
             break
 
-        # assign values to lists to neaten up subsequent event handling
-        disable_exp_btn_criteria = [
-            values['-BOOK LIST-'],
-            values['-EXPORT PATH-'],
-            (
-                values['-HANZI MODE NONE-'],
-                values['-HANZI MODE IND-'],
-                values['-HANZI MODE SHA-']
-            ),
-            (
-                values['-STATS MODE NONE-'],
-                values['-STATS MODE IND-'],
-                values['-STATS MODE COM-']
-            ),
-            (
-                values['-STATS OPT HANZI-'],
-                values['-STATS OPT UNIQUE HANZI-'],
-                values['-STATS OPT HANZI PERC-']
-            )
-        ]
-        hanzi_sort_opt = ['-HANZI SORT FORW-', '-HANZI SORT REV-']
-        dist_sort_opt = ['-DIST SORT FORW-', '-DIST SORT REV-']
-        learn_sliders = ['-USG EX SPIN-',
-                         '-COMP PERC SPIN-', '-FREQ THRESH SPIN-']
-        exp_opt = ['-EXP FILES HANZI-',
-                   '-EXP FILES LEARN-', '-EXP FILES BOTH-']
-
-        # import folder was selected
-        if event == '-BOOK PATH-':
-            folder = values['-BOOK PATH-']
-            if folder:
-                # get list of files in folder
-                file_list = os.listdir(folder)
-                # get list of .txt files in folder
-                filenames = [
-                    f.removesuffix('.txt') for f in file_list
-                    if os.path.isfile(os.path.join(folder, f)) and f.lower().endswith('.txt')
-                ]
-                # show list of .txt files in listbox with key -BOOK LIST-
-                window['-BOOK LIST-'].update(filenames)
-
-        # export folder was selected
-        elif event == '-EXPORT PATH-':
-            window['-EXPORT BUTTON-'].update(disabled=disable_export_button(*disable_exp_btn_criteria))
-
-        # enable/disable frequency/distance sorting options depending on selected hanzi export mode
-        elif event == '-BOOK LIST-':
-            window['-EXPORT BUTTON-'].update(disabled=disable_export_button(*disable_exp_btn_criteria))
-
-        # hanzi export mode was altered
-        elif event.startswith('-HANZI MODE'):
-            if event.endswith('NONE-'):
-                for elem in [*hanzi_sort_opt, *dist_sort_opt, *learn_sliders, *exp_opt]:
-                    window[elem].update(disabled=True)
-            elif event.endswith('IND-'):
-                for elem in [*hanzi_sort_opt, *dist_sort_opt, *learn_sliders, *exp_opt]:
-                    window[elem].update(disabled=False)
-            elif event.endswith('SHA-'):
-                for elem in [*hanzi_sort_opt]:
-                    window[elem].update(disabled=False)
-                for elem in [*dist_sort_opt, *learn_sliders, *exp_opt]:
-                    window[elem].update(disabled=True)
-            window['-EXPORT BUTTON-'].update(disabled=disable_export_button(*disable_exp_btn_criteria))
-
-        # statistics export mode was altered
-        elif event.startswith('-STATS MODE'):
-            statistics_options_checkboxes = ['-STATS OPT HANZI-', '-STATS OPT UNIQUE HANZI-', '-STATS OPT HANZI PERC-']
-            if event.endswith('NONE-'):
-                for checkbox in statistics_options_checkboxes:
-                    window[checkbox].update(disabled=True)
-            else:
-                for checkbox in statistics_options_checkboxes:
-                    window[checkbox].update(disabled=False)
-            window['-EXPORT BUTTON-'].update(disabled=disable_export_button(*disable_exp_btn_criteria))
-
-        # statistics export option was altered
-        elif event.startswith('-STATS OPT'):
-            window['-EXPORT BUTTON-'].update(disabled=disable_export_button(*disable_exp_btn_criteria))
-
-        # export button was selected and listbox item is selected
-        elif event == '-EXPORT BUTTON-':
-            if len(values['-BOOK LIST-']) >= 1:
-                try:
-                    if not os.path.exists(values['-EXPORT PATH-']):
-                        os.makedirs(values['-EXPORT PATH-'])
-                except IOError:
-                    print(f'could not create directory "{values["-EXPORT PATH-"]}"')
-                    break
-
-                hanzi_export_mode = 1
-                if values['-HANZI MODE NONE-']:
-                    hanzi_export_mode = 0
-                elif values['-HANZI MODE SHA-']:
-                    hanzi_export_mode = 2
-
-                file_export_option = 1
-                if values['-EXP FILES HANZI-']:
-                    file_export_option = 0
-                elif values['-EXP FILES BOTH-']:
-                    file_export_option = 2
-
-                hanzi_frequency_order = True
-                if values['-HANZI SORT FORW-']:
-                    hanzi_frequency_order = False
-
-                hanzi_distance_order = True
-                if values['-DIST SORT FORW-']:
-                    hanzi_distance_order = False
-
-                stats_export_mode = 2
-                if values['-STATS MODE NONE-']:
-                    stats_export_mode = 0
-                elif values['-STATS MODE IND-']:
-                    stats_export_mode = 1
-
-                stats_export_options = (
-                    values['-STATS OPT HANZI-'],
-                    values['-STATS OPT UNIQUE HANZI-'],
-                    values['-STATS OPT HANZI PERC-']
-                )
-
-                comprehension_percentage = int(values['-COMP PERC SPIN-'])
-                frequency_threshold = int(values['-FREQ THRESH SPIN-'])
-                example_sentences = int(values['-USG EX SPIN-'])
-
-                old_stdout = sys.stdout
-                new_stdout = io.StringIO()
-                sys.stdout = new_stdout
-
-                export_books(
-                    values['-BOOK LIST-'],
-                    values['-BOOK PATH-'],
-                    values['-EXPORT PATH-'],
-                    (hanzi_export_mode, hanzi_frequency_order, hanzi_distance_order, example_sentences),
-                    file_export_option,
-                    (comprehension_percentage, frequency_threshold, example_sentences,
-                     hanzi_frequency_order, hanzi_distance_order),
-                    (stats_export_mode, stats_export_options)
-                )
-
-                sg.popup_scrolled(new_stdout.getvalue(), title='Export Log', size=(50, 20))
-                sys.stdout = old_stdout
+        handler = HANDLERS.get(event)
+        if handler is None:
+            handler = next((prefix_handler for prefix, prefix_handler in PREFIX_HANDLERS
+                            if event.startswith(prefix)), None)
+        if handler is not None and handler(window, values, event):
+            break
 
     window.close()
+    shutdown_book_pool()
 
 
 if __name__ == "__main__":
@@ -9,10 +9,8 @@ __author__ = 'Waldo Luis Ribeiro'
 
 
 def index_of_first(lst, pred):
-    for i, v in enumerate(lst):
-        if pred(v):
-            return i
-    return -1
+    return next((i for i, v in enumerate(lst) if pred(v)), -1)
+
 
 # def multisort(xs, specs):
 #     for key, reverse in reversed(specs):